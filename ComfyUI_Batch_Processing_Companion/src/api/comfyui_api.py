@@ -5,31 +5,83 @@ import requests
 import json
 import os
 import time
+from requests.adapters import HTTPAdapter
+
+# orjson为可选依赖，解析大体积的工作流/历史记录JSON更快
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# websocket-client为可选依赖，用于实时接收任务完成通知，未安装时回退到轮询
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+class ComfyUIExecutionError(RuntimeError):
+    """ComfyUI执行工作流出错或被中断"""
+
 
 class ComfyUIAPI:
     def __init__(self, base_url="http://127.0.0.1:8188", timeout=2700, retry_count=3):
         self.base_url = base_url
         self.timeout = timeout
         self.retry_count = retry_count
+        
+        # 复用连接池，批量请求时避免每次重新建立TCP连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+    
+    @staticmethod
+    def _parse_json(response):
+        """解析响应JSON，优先使用orjson"""
+        if orjson is not None:
+            try:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError as e:
+                # 与response.json()抛出相同的异常类型，保证两种解析方式的重试行为一致
+                raise requests.JSONDecodeError(e.msg, e.doc, e.pos)
+        return response.json()
+    
+    @staticmethod
+    def _dump_json(data):
+        """序列化请求体为UTF-8字节，优先使用orjson"""
+        if orjson is not None:
+            return orjson.dumps(data)
+        return json.dumps(data).encode("utf-8")
     
     def _make_request(self, endpoint, method="GET", data=None, files=None):
         """发送请求并处理重试逻辑"""
         url = f"{self.base_url}/{endpoint}"
         
+        # JSON请求体只序列化一次，重试时直接复用；已序列化的字节直接发送
+        body = None
+        if method == "POST" and not files:
+            body = data if isinstance(data, bytes) else self._dump_json(data)
+        
         for attempt in range(self.retry_count):
             try:
                 if method == "GET":
-                    response = requests.get(url, timeout=self.timeout)
+                    response = self.session.get(url, timeout=self.timeout)
                 elif method == "POST":
                     if files:
-                        response = requests.post(url, data=data, files=files, timeout=self.timeout)
+                        response = self.session.post(url, data=data, files=files, timeout=self.timeout)
                     else:
-                        response = requests.post(url, json=data, timeout=self.timeout)
+                        response = self.session.post(
+                            url, data=body, headers={"Content-Type": "application/json"}, timeout=self.timeout
+                        )
                 else:
                     raise ValueError(f"不支持的请求方法: {method}")
                 
                 response.raise_for_status()
-                return response.json()
+                return self._parse_json(response)
             except requests.RequestException as e:
                 if attempt == self.retry_count - 1:
                     raise
@@ -44,7 +96,7 @@ class ComfyUIAPI:
         return self._make_request("workflows")
     
     def queue_workflow(self, workflow_data):
-        """提交工作流到队列"""
+        """提交工作流到队列，workflow_data可为dict或已序列化的JSON字节"""
         return self._make_request("prompt", method="POST", data=workflow_data)
     
     def get_history(self, prompt_id):
@@ -59,10 +111,25 @@ class ComfyUIAPI:
             "type": folder_type
         }
         url = f"{self.base_url}/view"
-        response = requests.get(url, params=params, timeout=self.timeout)
+        response = self.session.get(url, params=params, timeout=self.timeout)
         response.raise_for_status()
         return response.content
     
+    def download_image(self, filename, save_path, subfolder="", folder_type="output"):
+        """下载生成的图片，分块写入文件，不在内存中保留整张图片"""
+        params = {
+            "filename": filename,
+            "subfolder": subfolder,
+            "type": folder_type
+        }
+        url = f"{self.base_url}/view"
+        with self.session.get(url, params=params, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            with open(save_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+        return save_path
+    
     def upload_image(self, image_path, filename=None):
         """上传图片"""
         if not os.path.exists(image_path):
@@ -73,6 +140,49 @@ class ComfyUIAPI:
         
         with open(image_path, "rb") as f:
             files = {"image": (filename, f, "image/png")}
-            response = requests.post(f"{self.base_url}/upload/image", files=files, timeout=self.timeout)
+            response = self.session.post(f"{self.base_url}/upload/image", files=files, timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
\ No newline at end of file
+            return self._parse_json(response)
+    
+    def connect_websocket(self, client_id):
+        """连接ComfyUI的WebSocket，未安装websocket-client时返回None"""
+        if websocket is None:
+            return None
+        ws_url = self.base_url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+        return websocket.create_connection(f"{ws_url}/ws?clientId={client_id}", timeout=self.timeout)
+    
+    def wait_for_prompt(self, ws, prompt_id, deadline=None, stop_event=None, poll_slice=0.5):
+        """通过WebSocket等待指定任务执行结束，deadline为time.monotonic()截止时间
+        
+        传入stop_event时按poll_slice分段接收消息，stop_event置位后返回False；任务完成返回True
+        """
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            timeout = poll_slice if stop_event is not None else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("等待任务完成超时")
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            if timeout is not None:
+                ws.settimeout(timeout)
+            try:
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                # 本段时间内没有消息，回到循环开头检查取消和截止时间
+                continue
+            # 二进制帧为预览图，忽略
+            if not isinstance(message, str):
+                continue
+            msg = json.loads(message)
+            data = msg.get("data", {})
+            if data.get("prompt_id") != prompt_id:
+                continue
+            # node为None表示该任务的所有节点已执行完毕
+            if msg.get("type") == "executing" and data.get("node") is None:
+                return True
+            if msg.get("type") == "execution_error":
+                raise ComfyUIExecutionError(f"工作流执行失败: {data.get('exception_message', '')}")
+            if msg.get("type") == "execution_interrupted":
+                raise ComfyUIExecutionError("工作流执行已中断")
@@ -4,21 +4,40 @@
 import os
 import time
 import json
+import string
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from PIL import Image
-from src.api.comfyui_api import ComfyUIAPI
+from src.api.comfyui_api import ComfyUIAPI, ComfyUIExecutionError
 from src.api.ollama_api import OllamaAPI
 from src.api.tencent_translate import TencentTranslateAPI
 from src.utils.logger import Logger
 
 class ImageGenerator:
+    # 逐行需要写入的工作流参数：变量绑定 -> (节点ID, 参数键名)
+    PROMPT_NODE_INDEX = {
+        "正向提示词": ("6", "text"),
+        "负面提示词": ("7", "text"),
+    }
+    # 保存图片的输出节点ID
+    IMAGE_OUTPUT_NODE_ID = "9"
+    
     def __init__(self, config_manager, logger=None):
         self.config_manager = config_manager
-        self.logger = logger or Logger()
+        self.logger = logger or Logger(log_level=config_manager.log_level)
         self.comfyui_api = None
         self.ollama_api = None
         self.tencent_api = None
         
+        # 工作流模板缓存（按批次构建一次，避免逐行重复读取配置）
+        self._workflow_template = None
+        # 序列化后的工作流字符串模板，逐行只做占位符替换
+        self._prompt_template = None
+        # 关闭时置位，唤醒并结束所有正在等待的行
+        self._stop_event = threading.Event()
+        
         # 初始化API客户端
         self._init_apis()
     
@@ -26,13 +45,13 @@ class ImageGenerator:
         """初始化API客户端"""
         # 初始化ComfyUI API
         comfyui_url = self.config_manager.get("ComfyUI", "URL", "http://127.0.0.1:8188")
-        comfyui_timeout = int(self.config_manager.get("ComfyUI", "Timeout", "2700"))
-        self.comfyui_api = ComfyUIAPI(comfyui_url, comfyui_timeout)
+        self.comfyui_timeout = self.config_manager.get("ComfyUI", "Timeout", "2700", int)
+        self.comfyui_api = ComfyUIAPI(comfyui_url, self.comfyui_timeout)
         
         # 初始化Ollama API
         if self.config_manager.get("Ollama", "Enable", "false").lower() == "true":
             ollama_url = self.config_manager.get("Ollama", "URL", "http://localhost:11434")
-            ollama_timeout = int(self.config_manager.get("Ollama", "Timeout", "10"))
+            ollama_timeout = self.config_manager.get("Ollama", "Timeout", "10", int)
             self.ollama_api = OllamaAPI(ollama_url, ollama_timeout)
         
         # 初始化腾讯翻译API
@@ -42,9 +61,24 @@ class ImageGenerator:
             region = self.config_manager.get("TencentTranslate", "region", "ap-guangzhou")
             self.tencent_api = TencentTranslateAPI(secret_id, secret_key, region)
     
+    def close(self):
+        """释放API客户端占用的连接"""
+        self._stop_event.set()
+        if self.comfyui_api:
+            self.comfyui_api.close()
+    
     def generate_image_single(self, image_number, image_path, pos_prompt, neg_prompt, 
                             fps, duration, output_dir, ui_callback=None):
         """生成单个图片"""
+        # 每次生成前按当前配置重新构建模板，使修改后的参数立即生效
+        self._reset_templates()
+        job = self._submit_image_job(image_number, image_path, pos_prompt, neg_prompt, fps, duration, ui_callback)
+        return self._await_image_job(job, output_dir, ui_callback)
+    
+    def _submit_image_job(self, image_number, image_path, pos_prompt, neg_prompt, 
+                          fps, duration, ui_callback=None):
+        """校验图片、翻译提示词并提交工作流，返回 (图片序号, prompt_id, WebSocket连接)"""
+        ws = None
         try:
             # 更新UI状态
             if ui_callback:
@@ -66,24 +100,43 @@ class ImageGenerator:
             english_pos_prompt = self._get_english_prompt(pos_prompt)
             english_neg_prompt = self._get_english_prompt(neg_prompt)
             
+            # 每行使用独立的client_id，WebSocket只会收到本行任务的消息
+            client_id = str(uuid.uuid4())
+            
             # 构建工作流数据
             workflow_data = self._build_workflow_data(
-                image_path, english_pos_prompt, english_neg_prompt, fps, duration
+                image_path, english_pos_prompt, english_neg_prompt, fps, duration, client_id
             )
             
+            # 提交前先连接WebSocket，避免错过很快完成的任务的通知
+            ws = self._connect_websocket(client_id)
+            
             # 提交工作流
             if ui_callback:
                 ui_callback("status", f"提交工作流到ComfyUI...")
                 ui_callback("progress", 20)
             
-            prompt_id = self.comfyui_api.queue_workflow(workflow_data)
+            prompt_id = self.comfyui_api.queue_workflow(workflow_data)["prompt_id"]
+            return image_number, prompt_id, ws
             
+        except Exception as e:
+            if ws is not None:
+                ws.close()
+            self.logger.error("生成图片 %s 失败: %s", image_number, e)
+            if ui_callback:
+                ui_callback("status", f"生成失败: {e}")
+            raise
+    
+    def _await_image_job(self, job, output_dir, ui_callback=None, inflight=None):
+        """等待已提交的工作流生成完成，返回图片路径，结束时释放inflight名额"""
+        image_number, prompt_id, ws = job
+        try:
             # 等待生成完成
             if ui_callback:
                 ui_callback("status", f"等待图片生成完成...")
                 ui_callback("progress", 40)
             
-            image_path = self._wait_for_image_generation(prompt_id, output_dir, image_number, ui_callback)
+            image_path = self._wait_for_image_generation(prompt_id, output_dir, image_number, ui_callback, ws)
             
             if ui_callback:
                 ui_callback("status", f"图片 {image_number} 生成完成！")
@@ -92,10 +145,15 @@ class ImageGenerator:
             return image_path
             
         except Exception as e:
-            self.logger.error(f"生成图片 {image_number} 失败: {e}")
+            self.logger.error("生成图片 %s 失败: %s", image_number, e)
             if ui_callback:
                 ui_callback("status", f"生成失败: {e}")
             raise
+        finally:
+            if ws is not None:
+                ws.close()
+            if inflight is not None:
+                inflight.release()
     
     def _get_english_prompt(self, prompt):
         """获取英文提示词"""
@@ -107,28 +165,36 @@ class ImageGenerator:
             try:
                 return self.tencent_api.translate_text(prompt)
             except Exception as e:
-                self.logger.warning(f"腾讯翻译失败，尝试使用Ollama: {e}")
+                self.logger.warning("腾讯翻译失败，尝试使用Ollama: %s", e)
         
         # 其次使用Ollama
         if self.ollama_api:
             try:
                 return self.ollama_api.translate_to_english(prompt)
             except Exception as e:
-                self.logger.warning(f"Ollama翻译失败，使用原提示词: {e}")
+                self.logger.warning("Ollama翻译失败，使用原提示词: %s", e)
         
         # 如果都失败，使用原提示词
         return prompt
     
-    def _build_workflow_data(self, image_path, pos_prompt, neg_prompt, fps, duration):
-        """构建工作流数据"""
+    def _reset_templates(self):
+        """丢弃缓存的模板，下次使用时按当前配置重新构建"""
+        self._workflow_template = None
+        self._prompt_template = None
+    
+    def _get_workflow_template(self):
+        """获取工作流模板（缓存，逐行只修改提示词）"""
+        if self._workflow_template is not None:
+            return self._workflow_template
+        
         # 这里需要根据实际的ComfyUI工作流JSON结构进行构建
         # 以下是示例结构，需要根据实际情况调整
-        workflow = {
+        self._workflow_template = {
             "3": {
                 "inputs": {
                     "seed": self.config_manager.get("ComfyUI", "Seed", "-1"),
-                    "steps": int(self.config_manager.get("ComfyUI", "Steps", "20")),
-                    "cfg": float(self.config_manager.get("ComfyUI", "CFGScale", "7.0")),
+                    "steps": self.config_manager.get("ComfyUI", "Steps", "20", int),
+                    "cfg": self.config_manager.get("ComfyUI", "CFGScale", "7.0", float),
                     "sampler_name": self.config_manager.get("ComfyUI", "Sampler", "euler"),
                     "scheduler": self.config_manager.get("ComfyUI", "Scheduler", "normal"),
                     "denoise": 1.0,
@@ -144,14 +210,14 @@ class ImageGenerator:
             },
             "6": {
                 "inputs": {
-                    "text": pos_prompt,
+                    "text": "",
                     "clip": ["5", 1]
                 },
                 "class_type": "CLIPTextEncode"
             },
             "7": {
                 "inputs": {
-                    "text": neg_prompt,
+                    "text": "",
                     "clip": ["5", 1]
                 },
                 "class_type": "CLIPTextEncode"
@@ -171,70 +237,236 @@ class ImageGenerator:
                 "class_type": "SaveImage"
             }
         }
+        return self._workflow_template
+    
+    @staticmethod
+    def _clone_workflow(workflow):
+        """复制工作流，逐行只会修改各节点的inputs，因此只复制inputs这一层"""
+        return {
+            node_id: {**node, "inputs": dict(node["inputs"])}
+            for node_id, node in workflow.items()
+        }
+    
+    def _get_prompt_template(self):
+        """获取序列化后的/prompt请求体字符串模板（缓存）"""
+        if self._prompt_template is not None:
+            return self._prompt_template
+        
+        # 在逐行写入的位置放置标记，序列化一次后替换为占位符
+        workflow = self._clone_workflow(self._get_workflow_template())
+        markers = {}
+        for i, (binding, (node_id, param_key)) in enumerate(self.PROMPT_NODE_INDEX.items()):
+            marker = f"__ROW_VALUE_{i}__"
+            workflow[node_id]["inputs"][param_key] = marker
+            markers[binding] = marker
+        markers["client_id"] = "__CLIENT_ID__"
+        
+        # 整个请求体一起序列化，逐行替换后即可直接发送，无需再次编码
+        body = {"prompt": workflow, "client_id": markers["client_id"]}
+        # 转义其余内容中的$，避免被当作占位符
+        serialized = json.dumps(body).replace("$", "$$")
+        for marker in markers.values():
+            serialized = serialized.replace(json.dumps(marker), "${" + marker + "}")
+        
+        self._prompt_template = (string.Template(serialized), markers)
+        return self._prompt_template
+    
+    def _build_workflow_data(self, image_path, pos_prompt, neg_prompt, fps, duration,
+                             client_id="batch-image-generator"):
+        """构建工作流数据，返回已序列化的/prompt请求体（UTF-8字节）"""
+        template, markers = self._get_prompt_template()
+        row_values = {"正向提示词": pos_prompt, "负面提示词": neg_prompt, "client_id": client_id}
+        body = template.substitute(
+            {marker: json.dumps(row_values[binding]) for binding, marker in markers.items()}
+        )
+        
+        return body.encode("utf-8")
+    
+    def _connect_websocket(self, client_id):
+        """连接ComfyUI WebSocket，失败时返回None并回退到轮询"""
+        try:
+            return self.comfyui_api.connect_websocket(client_id)
+        except Exception as e:
+            self.logger.warning("连接ComfyUI WebSocket失败，改为轮询: %s", e)
+            return None
+    
+    def _find_output_image(self, outputs):
+        """在历史记录输出中查找生成的图片，优先查找图片输出节点，一次遍历完成"""
+        node_ids = [nid for nid in outputs if nid != self.IMAGE_OUTPUT_NODE_ID]
+        if self.IMAGE_OUTPUT_NODE_ID in outputs:
+            node_ids.insert(0, self.IMAGE_OUTPUT_NODE_ID)
+        
+        for node_id in node_ids:
+            for image_info in outputs[node_id].get("images", ()):
+                # 预览节点的图片类型为temp，只取保存到输出目录的图片
+                if image_info.get("type") == "output":
+                    return image_info
+        return None
+    
+    def _download_output_image(self, prompt_id, output_dir, image_number):
+        """查询一次历史记录，找到输出图片时下载并返回保存路径，否则返回None"""
+        history = self.comfyui_api.get_history(prompt_id)
+        if prompt_id not in history or "outputs" not in history[prompt_id]:
+            return None
+        
+        image_info = self._find_output_image(history[prompt_id]["outputs"])
+        if not image_info:
+            return None
         
-        return {"prompt": json.dumps(workflow), "client_id": "batch-image-generator"}
+        # 下载图片（流式写入磁盘）
+        image_path = os.path.join(output_dir, f"image_{image_number}.png")
+        return self.comfyui_api.download_image(
+            image_info["filename"], image_path,
+            image_info.get("subfolder", ""), image_info["type"]
+        )
     
-    def _wait_for_image_generation(self, prompt_id, output_dir, image_number, ui_callback=None):
+    def _wait_for_image_generation(self, prompt_id, output_dir, image_number, ui_callback=None, ws=None):
         """等待图片生成完成"""
-        max_wait_time = int(self.config_manager.get("ComfyUI", "Timeout", "2700"))
-        start_time = time.time()
+        max_wait_time = self.comfyui_timeout
+        # 使用单调时钟计算截止时间，不受系统时间调整影响
+        start_time = time.monotonic()
+        deadline = start_time + max_wait_time
+        # 轮询间隔从250ms开始指数增长，最长5秒：短任务能尽快拿到结果，长任务减少请求次数
+        poll_interval = 0.25
+        max_poll_interval = 5.0
         
-        while time.time() - start_time < max_wait_time:
+        # 优先通过WebSocket等待完成通知，收到完成通知后只需查询一次历史记录
+        if ws is not None:
             try:
-                # 检查历史记录
-                history = self.comfyui_api.get_history(prompt_id)
-                
-                if prompt_id in history and "outputs" in history[prompt_id]:
-                    # 检查是否有图片输出
-                    outputs = history[prompt_id]["outputs"]
-                    for node_id, node_output in outputs.items():
-                        if "files" in node_output:
-                            for file in node_output["files"]:
-                                if file.lower().endswith((".png", ".jpg", ".jpeg")):
-                                    # 下载图片
-                                    image_path = os.path.join(output_dir, f"image_{image_number}.png")
-                                    # 这里需要根据ComfyUI的实际输出方式调整下载逻辑
-                                    # 暂时简单返回路径
-                                    return image_path
+                finished = self.comfyui_api.wait_for_prompt(ws, prompt_id, deadline, self._stop_event)
+            except ComfyUIExecutionError:
+                # 工作流执行失败时历史记录中不会有图片，轮询只会等到超时
+                raise
+            except Exception as e:
+                self.logger.warning("WebSocket等待失败，改为轮询: %s", e)
+            else:
+                if not finished:
+                    raise RuntimeError("图片生成已取消")
+                # 任务已执行完毕，历史记录中没有图片说明不会再有输出，无需继续轮询
+                image_path = self._download_output_image(prompt_id, output_dir, image_number)
+                if image_path is None:
+                    raise RuntimeError("任务已完成，但未找到输出图片")
+                return image_path
+        
+        while time.monotonic() < deadline:
+            try:
+                # 检查历史记录，有图片输出时下载
+                image_path = self._download_output_image(prompt_id, output_dir, image_number)
+                if image_path is not None:
+                    return image_path
                 
                 # 更新进度
                 if ui_callback:
-                    elapsed = time.time() - start_time
+                    elapsed = time.monotonic() - start_time
                     progress = 40 + int((elapsed / max_wait_time) * 50)
                     progress = min(progress, 90)
                     ui_callback("progress", progress)
                 
-                time.sleep(5)  # 每5秒检查一次
-                
             except Exception as e:
-                self.logger.warning(f"检查生成状态失败: {e}")
-                time.sleep(5)
+                if self._stop_event.is_set():
+                    raise RuntimeError("图片生成已取消")
+                self.logger.warning("检查生成状态失败: %s", e)
+            
+            # 等待下一次查询（不超过截止时间），关闭时立即结束
+            if self._stop_event.wait(max(0, min(poll_interval, deadline - time.monotonic()))):
+                raise RuntimeError("图片生成已取消")
+            poll_interval = min(poll_interval * 1.7, max_poll_interval)
         
         raise TimeoutError("图片生成超时")
     
+    @staticmethod
+    def _make_row_callbacks(ui_callback, total):
+        """为批次中的每一行生成回调：状态加上图片序号前缀，进度汇总为所有行的平均值"""
+        if not ui_callback:
+            return [None] * total
+        
+        row_progress = [0] * total
+        lock = threading.Lock()
+        
+        def make_callback(index):
+            def callback(kind, value):
+                if kind == "progress":
+                    # 在锁内计算并回调，保证进度按顺序递增，不会在各行之间跳动
+                    with lock:
+                        row_progress[index] = value
+                        ui_callback("progress", sum(row_progress) // total)
+                else:
+                    if kind == "status":
+                        value = f"[图片 {index + 1}] {value}"
+                    ui_callback(kind, value)
+            return callback
+        
+        return [make_callback(i) for i in range(total)]
+    
     def batch_generate_images(self, image_files, pos_prompts, neg_prompts, fps, duration, 
                              output_dir, ui_callback=None):
         """批量生成图片"""
-        results = []
+        # 输出目录只需在批次开始时创建一次
+        os.makedirs(output_dir, exist_ok=True)
         
-        for i, (image_path, pos_prompt, neg_prompt) in enumerate(zip(image_files, pos_prompts, neg_prompts)):
-            image_number = i + 1
-            try:
-                image_path = self.generate_image_single(
-                    image_number, image_path, pos_prompt, neg_prompt, fps, duration, output_dir, ui_callback
+        # 每个批次重新读取一次配置，批次内各行共用同一模板
+        # （在提交到线程池前构建，避免多个线程同时构建）
+        self._reset_templates()
+        self._get_prompt_template()
+        
+        # Concurrency限制同时校验、翻译和提交的行数；
+        # MaxInflight限制已提交但未完成的行数，即ComfyUI队列深度和同时打开的WebSocket数量，
+        # 大于Concurrency时提交可以领先于等待，让ComfyUI队列保持排满
+        concurrency = max(1, self.config_manager.get("ComfyUI", "Concurrency", "4", int))
+        max_inflight = max(
+            concurrency,
+            self.config_manager.get("ComfyUI", "MaxInflight", str(concurrency * 2), int)
+        )
+        inflight = threading.Semaphore(max_inflight)
+        
+        rows = list(zip(image_files, pos_prompts, neg_prompts))
+        results = [None] * len(rows)
+        # 多行并发回调，汇总后再交给UI
+        row_callbacks = self._make_row_callbacks(ui_callback, len(rows))
+        
+        # 等待结果使用独立的线程池，正在等待的行不会占用提交线程
+        with ThreadPoolExecutor(max_workers=max_inflight) as await_executor, \
+                ThreadPoolExecutor(max_workers=concurrency) as submit_executor:
+            def submit_row(image_number, image_path, pos_prompt, neg_prompt):
+                # 提交成功后立即开始等待结果，由_await_image_job释放名额
+                try:
+                    job = self._submit_image_job(
+                        image_number, image_path, pos_prompt, neg_prompt, fps, duration,
+                        row_callbacks[image_number - 1]
+                    )
+                except Exception:
+                    inflight.release()
+                    raise
+                return await_executor.submit(
+                    self._await_image_job, job, output_dir, row_callbacks[image_number - 1], inflight
                 )
-                results.append({
-                    "image_number": image_number,
-                    "image_path": image_path,
-                    "output_path": image_path,
-                    "status": "success"
-                })
-            except Exception as e:
-                results.append({
-                    "image_number": image_number,
-                    "image_path": image_path,
-                    "error": str(e),
-                    "status": "failed"
-                })
-        
-        return results
\ No newline at end of file
+            
+            # 提交前先占用名额，未完成的行达到上限时暂停提交
+            submit_futures = []
+            for i, (image_path, pos_prompt, neg_prompt) in enumerate(rows):
+                inflight.acquire()
+                submit_futures.append(
+                    submit_executor.submit(submit_row, i + 1, image_path, pos_prompt, neg_prompt)
+                )
+            
+            for i, future in enumerate(submit_futures):
+                try:
+                    output_path = future.result().result()
+                    results[i] = {
+                        "image_number": i + 1,
+                        "image_path": output_path,
+                        "output_path": output_path,
+                        "status": "success"
+                    }
+                except Exception as e:
+                    results[i] = {
+                        "image_number": i + 1,
+                        "image_path": rows[i][0],
+                        "error": str(e),
+                        "status": "failed"
+                    }
+                    # 失败的行也计为已完成，避免批次进度停在中途
+                    if row_callbacks[i]:
+                        row_callbacks[i]("progress", 100)
+        
+        return results
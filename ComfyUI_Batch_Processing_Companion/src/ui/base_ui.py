@@ -107,20 +107,41 @@ class BaseUI:
         # 4. 将主框架添加到Canvas的窗口中
         self.canvas.create_window((0, 0), window=self.main_frame, anchor=tk.NW)
         
-        # 5. 绑定主框架大小变化事件，更新Canvas滚动区域
-        self.main_frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        # 5. 绑定主框架大小变化事件，更新Canvas滚动区域（合并连续事件，避免拖动时反复计算bbox）
+        self._scroll_after_id = None
+        self.main_frame.bind("<Configure>", self._schedule_scrollregion_update)
         
         # 6. 绑定鼠标滚轮事件
         def _on_mousewheel(event):
             # 对于Windows系统
             self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
         
-        # 为Canvas绑定鼠标滚轮事件
-        self.canvas.bind_all("<MouseWheel>", _on_mousewheel)
+        def _on_canvas_leave(event):
+            # 鼠标移入Canvas内部子控件时也会触发<Leave>，此时不解绑
+            widget = self.canvas.winfo_containing(event.x_root, event.y_root)
+            canvas_path = str(self.canvas)
+            # 按路径层级判断，避免把同前缀的兄弟控件（如.!canvas2）当成子控件
+            if widget is None or not (str(widget) == canvas_path or str(widget).startswith(canvas_path + ".")):
+                self.canvas.unbind_all("<MouseWheel>")
+        
+        # 仅在鼠标位于Canvas上方时绑定滚轮事件，离开时解绑，避免全局滚轮事件都经过回调
+        self.canvas.bind("<Enter>", lambda e: self.canvas.bind_all("<MouseWheel>", _on_mousewheel))
+        self.canvas.bind("<Leave>", _on_canvas_leave)
         
         # 7. 配置网格权重
         self.configure_grid_weights()
     
+    def _schedule_scrollregion_update(self, event=None):
+        """合并短时间内的多次<Configure>事件，只执行最后一次滚动区域更新"""
+        if self._scroll_after_id is not None:
+            self.root.after_cancel(self._scroll_after_id)
+        self._scroll_after_id = self.root.after(16, self._update_scrollregion)
+    
+    def _update_scrollregion(self):
+        """更新Canvas滚动区域"""
+        self._scroll_after_id = None
+        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+    
     def configure_grid_weights(self):
         """配置网格权重"""
         # 配置主框架的网格权重
@@ -140,26 +161,23 @@ class BaseUI:
         # 创建自定义确认对话框
         exit_window = tk.Toplevel(self.root)
         exit_window.title("确认关闭")
-        exit_window.geometry("300x200")
         exit_window.resizable(False, False)
         exit_window.transient(self.root)
         exit_window.grab_set()
         
         # 计算并设置对话框居中位置
-        exit_window.update_idletasks()  # 确保获取正确的尺寸
+        # 对话框尺寸固定，无需等待布局完成再查询尺寸
+        dialog_width, dialog_height = 300, 200
         # 获取主窗口的位置和尺寸
         root_x = self.root.winfo_x()
         root_y = self.root.winfo_y()
         root_width = self.root.winfo_width()
         root_height = self.root.winfo_height()
-        # 获取对话框的尺寸
-        dialog_width = exit_window.winfo_width()
-        dialog_height = exit_window.winfo_height()
         # 计算居中位置
         x = root_x + (root_width - dialog_width) // 2
         y = root_y + (root_height - dialog_height) // 2
-        # 设置对话框位置
-        exit_window.geometry(f"+{x}+{y}")
+        # 一次设置对话框尺寸和位置
+        exit_window.geometry(f"{dialog_width}x{dialog_height}+{x}+{y}")
         
         # 使用ttkbootstrap组件和样式
         main_frame = ttk.Frame(exit_window, padding="20")
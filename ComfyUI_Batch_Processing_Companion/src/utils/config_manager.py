@@ -3,21 +3,28 @@
 
 import configparser
 import os
+import shutil
+import tempfile
 
 class ConfigManager:
     def __init__(self, config_file="setting.ini"):
         self.config_file = config_file
         self.config = configparser.ConfigParser()
+        # 加载过程中产生的修改只记录，加载结束后统一写入一次
+        self._config_dirty = False
         
         # 读取配置文件
         if os.path.exists(self.config_file):
-            self.config.read(self.config_file, encoding="utf-8")
+            # utf-8-sig 由解码器直接去除BOM（Windows记事本保存的ini常带BOM）
+            self.config.read(self.config_file, encoding="utf-8-sig")
         
         # 确保所有配置组存在
         self._ensure_sections()
         
         # 加载配置
         self._load_config()
+        if self._config_dirty:
+            self.save_config()
     
     def _ensure_sections(self):
         """确保所有必要的配置节存在"""
@@ -26,19 +33,21 @@ class ConfigManager:
             if section not in self.config:
                 self.config[section] = {}
     
-    def _get_value(self, section, key, fallback=None):
-        """获取配置值并去除注释"""
+    def _get_value(self, section, key, fallback=None, cast=None):
+        """获取配置值并去除行内注释，可选转换类型"""
         value = self.config.get(section, key, fallback=fallback)
         if isinstance(value, str):
-            value = value.split(';')[0].strip()
+            value = value.split(';', 1)[0].strip()
+        if cast is not None and value is not None:
+            value = cast(value)
         return value
     
     def _load_config(self):
         """加载配置项"""
         # API相关配置
         self.COMFYUI_URL = self._get_value("API", "base_url", "http://127.0.0.1:8188")
-        self.TIMEOUT = int(self._get_value("API", "timeout", "2700"))
-        self.retry_count = int(self._get_value("API", "retry_count", "3"))
+        self.TIMEOUT = self._get_value("API", "timeout", "2700", int)
+        self.retry_count = self._get_value("API", "retry_count", "3", int)
         
         # ComfyUI相关配置
         # 优先读取[comfyui_gen]章节的workflow_path配置（用户期望使用的版本）
@@ -53,14 +62,14 @@ class ConfigManager:
         self.temp_cleanup = self._get_value("Application", "temp_cleanup", "on_exit")
         
         # System相关配置
-        self.content_rows = int(self._get_value("System", "content_rows", "30"))
+        self.content_rows = self._get_value("System", "content_rows", "30", int)
         self.project_dir = self._get_value("System", "project_dir", "project")
         
         # UI相关配置
-        self.ui_width = int(self._get_value("UI", "width", "1100"))
-        self.ui_height = int(self._get_value("UI", "height", "1000"))
-        self.ui_position_x = int(self._get_value("UI", "position_x", "0"))
-        self.ui_position_y = int(self._get_value("UI", "position_y", "0"))
+        self.ui_width = self._get_value("UI", "width", "1100", int)
+        self.ui_height = self._get_value("UI", "height", "1000", int)
+        self.ui_position_x = self._get_value("UI", "position_x", "0", int)
+        self.ui_position_y = self._get_value("UI", "position_y", "0", int)
         
         # 主题配置处理
         custom_theme = self._get_value("UI", "custom_theme", "")
@@ -73,10 +82,10 @@ class ConfigManager:
         else:
             self.ui_theme = "cyborg"
             self.config["UI"]["custom_theme"] = self.ui_theme
-            self.save_config()
+            self._config_dirty = True
         
         self.config["UI"]["theme"] = self.ui_theme
-        self.ui_font_size = int(self._get_value("UI", "font_size", "10"))
+        self.ui_font_size = self._get_value("UI", "font_size", "10", int)
         
         # 批量生成图片数范围
         self.BATCH_RANGE = list(range(1, 6))
@@ -91,13 +100,26 @@ class ConfigManager:
         self.tencent_api_region = self._get_value("TencentTranslate", "region", "ap-guangzhou")
     
     def save_config(self):
-        """保存配置文件"""
-        with open(self.config_file, "w", encoding="utf-8") as f:
-            self.config.write(f)
+        """保存配置文件（先写临时文件再替换，避免写入中断导致配置损坏）"""
+        config_dir = os.path.dirname(os.path.abspath(self.config_file))
+        fd, tmp_path = tempfile.mkstemp(dir=config_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                self.config.write(f)
+            # mkstemp创建的文件权限为0600，替换前沿用原配置文件的权限
+            if os.path.exists(self.config_file):
+                shutil.copymode(self.config_file, tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.config_file)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self._config_dirty = False
     
-    def get(self, section, key, fallback=None):
+    def get(self, section, key, fallback=None, cast=None):
         """获取配置项"""
-        return self._get_value(section, key, fallback)
+        return self._get_value(section, key, fallback, cast)
     
     def set(self, section, key, value):
         """设置配置项"""
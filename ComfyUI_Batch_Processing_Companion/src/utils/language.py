@@ -5,6 +5,8 @@
 实现中英文界面切换功能
 """
 
+import functools
+
 # 语言翻译字典
 TRANSLATIONS = {
     # 窗口标题
@@ -1334,6 +1336,19 @@ class LanguageManager:
         cls._callbacks.clear()
 
 
+@functools.lru_cache(maxsize=None)
+def _get_translation_table(lang_code):
+    """获取指定语言的翻译表（每种语言只构建一次）
+    
+    Args:
+        lang_code: 语言代码
+        
+    Returns:
+        原文 -> 译文 的字典
+    """
+    return {text: translations.get(lang_code, text) for text, translations in TRANSLATIONS.items()}
+
+
 def tr(text):
     """翻译函数
     
@@ -1343,13 +1358,8 @@ def tr(text):
     Returns:
         翻译后的文本
     """
-    current_lang = LanguageManager.get_language()
-    
-    if text in TRANSLATIONS:
-        return TRANSLATIONS[text].get(current_lang, text)
-    
     # 如果没有找到翻译，返回原文
-    return text
+    return _get_translation_table(LanguageManager.get_language()).get(text, text)
 
 
 def get_language_display_name(lang_code):